@@ -1,16 +1,50 @@
 from sqlite3 import dbapi2 as sqlite
 from contextlib import contextmanager
+import base64
 import json
-from typing import Any, Dict
+import logging
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 
+db_logger = logging.getLogger(__name__)
+
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS kv_store(
    key TEXT PRIMARY KEY NOT NULL,
-   value TEXT NOT NULL
+   value TEXT NOT NULL,
+   expires_at REAL,
+   ring_id TEXT
 );
 """
 
+# Columns added after the original schema, created in place on older databases by write_schema.
+ADDED_COLUMNS = (
+    ("expires_at", "REAL"),
+    ("ring_id", "TEXT"),
+)
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS kv_store_expires_at ON kv_store(expires_at) WHERE expires_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS kv_store_ring_id ON kv_store(ring_id, key);
+"""
+
+NOT_EXPIRED = "(expires_at IS NULL OR expires_at > ?)"
+PURGE_BATCH_SIZE = 500
+AUTO_VACUUM_INCREMENTAL = 2
+INCREMENTAL_VACUUM_PAGES = 100
+# Ring identifiers are stored as zero padded hex so that text order matches numeric order for up to 160 bits.
+RING_ID_WIDTH = 40
+SCAN_ORDERS = {
+    "key": ("key",),
+    "ring_id": ("ring_id", "key"),
+}
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+ScanRow = namedtuple("ScanRow", ["key", "value", "ring_id", "expires_at"])
+
 
 def open_conn(*args, **kwargs) -> sqlite.Connection:
     conn = sqlite.connect(*args, **kwargs)
@@ -37,15 +71,43 @@ def cursor_manager(connection):
     cursor.close()
 
 
-def write_schema(connnection: sqlite.Connection):
+def write_schema(connnection: sqlite.Connection, rebuild_for_vacuum: bool = False):
+    enable_incremental_vacuum(connnection, rebuild=rebuild_for_vacuum)
     connnection.executescript(SCHEMA)
+    columns = {row[1] for row in connnection.execute("PRAGMA table_info(kv_store)")}
+    for name, column_type in ADDED_COLUMNS:
+        if name not in columns:
+            connnection.execute("ALTER TABLE kv_store ADD COLUMN {0} {1}".format(name, column_type))
+    connnection.executescript(INDEXES)
+
+
+def enable_incremental_vacuum(conn: sqlite.Connection, rebuild: bool = False):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        return
+    # A new auto_vacuum mode only applies to an existing file once the whole database has been rebuilt, which
+    # rewrites every page and needs about as much free disk again as the file itself.
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'kv_store'").fetchone():
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    elif rebuild:
+        db_logger.warning("Switching kv_store to incremental auto_vacuum, running a one-time VACUUM...")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        db_logger.warning(
+            "Incremental vacuum is off for this database, so space freed by purging expired keys is not returned "
+            "to the filesystem. Restart once with --rebuild-for-vacuum to enable it."
+        )
+
+
+def format_ring_id(identifier: int) -> str:
+    return "{0:0{1}x}".format(identifier, RING_ID_WIDTH)
 
 
-def get_value_by_key(conn: sqlite.Connection, key, default=None) -> Any:
+def get_value_by_key(conn: sqlite.Connection, key, default=None, now: Optional[float] = None) -> Any:
     with cursor_manager(conn) as c:
         c.execute(
-            "SELECT value FROM kv_store WHERE key = ?",
-            (key,)
+            "SELECT value FROM kv_store WHERE key = ? AND " + NOT_EXPIRED,
+            (key, time.time() if now is None else now)
         )
         row = c.fetchone()
         if row:
@@ -54,44 +116,153 @@ def get_value_by_key(conn: sqlite.Connection, key, default=None) -> Any:
             return default
 
 
-def get_all_kv_pairs(conn: sqlite.Connection) -> Dict[str, Any]:
+def get_all_kv_pairs(conn: sqlite.Connection, now: Optional[float] = None) -> Dict[str, Any]:
     with cursor_manager(conn) as c:
         c.execute(
-            "SELECT key, value FROM kv_store",
+            "SELECT key, value FROM kv_store WHERE " + NOT_EXPIRED,
+            (time.time() if now is None else now,)
         )
         return {
             row["key"]: json.loads(row["value"]) for row in c.fetchall()
         }
 
 
-def get_kv_pair_count(conn: sqlite.Connection) -> int:
+def get_kv_pair_count(conn: sqlite.Connection, now: Optional[float] = None) -> int:
     with cursor_manager(conn) as c:
         c.execute(
-            "SELECT COUNT(key) AS pair_count FROM kv_store"
+            "SELECT COUNT(key) AS pair_count FROM kv_store WHERE " + NOT_EXPIRED,
+            (time.time() if now is None else now,)
         )
         return c.fetchone()["pair_count"]
 
 
-def does_key_exist(conn: sqlite.Connection, key) -> bool:
+def get_expired_key_count(conn: sqlite.Connection, now: Optional[float] = None) -> int:
     with cursor_manager(conn) as c:
         c.execute(
-            "SELECT 1 FROM kv_store WHERE key = ?",
-            (key,)
+            "SELECT COUNT(key) AS expired_count FROM kv_store WHERE expires_at <= ?",
+            (time.time() if now is None else now,)
+        )
+        return c.fetchone()["expired_count"]
+
+
+def does_key_exist(conn: sqlite.Connection, key, now: Optional[float] = None) -> bool:
+    with cursor_manager(conn) as c:
+        c.execute(
+            "SELECT 1 FROM kv_store WHERE key = ? AND " + NOT_EXPIRED,
+            (key, time.time() if now is None else now)
         )
         return bool(c.fetchone())
 
 
-def set_key_value_pair(conn: sqlite.Connection, key: str, value: Any):
+def set_key_value_pair(conn: sqlite.Connection, key: str, value: Any, expires_at: Optional[float] = None,
+                       ring_id: Optional[int] = None):
     with cursor_manager(conn) as c:
         c.execute(
-            "INSERT OR REPLACE INTO kv_store(key, value) VALUES (?, ?)",
-            (key, json.dumps(value))
+            "INSERT OR REPLACE INTO kv_store(key, value, expires_at, ring_id) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), expires_at, format_ring_id(ring_id) if ring_id is not None else None)
         )
 
 
+def backfill_ring_ids(conn: sqlite.Connection, hash_fn: Callable[[str], int], batch_size: int = DEFAULT_PAGE_SIZE) -> int:
+    total = 0
+    while True:
+        with transaction_wrapper(conn) as t:
+            with cursor_manager(t) as c:
+                c.execute(
+                    "SELECT key FROM kv_store WHERE ring_id IS NULL LIMIT ?",
+                    (batch_size,)
+                )
+                keys = [row["key"] for row in c.fetchall()]
+                c.executemany(
+                    "UPDATE kv_store SET ring_id = ? WHERE key = ?",
+                    [(format_ring_id(hash_fn(key)), key) for key in keys]
+                )
+        total += len(keys)
+        if len(keys) < batch_size:
+            return total
+
+
+def check_page_size(limit: int) -> int:
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+        raise ValueError("Page size must be a positive integer, got: {0!r}".format(limit))
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def scan_kv_pairs(conn: sqlite.Connection, order: str = "key", after: Optional[Tuple] = None,
+                  limit: int = DEFAULT_PAGE_SIZE, now: Optional[float] = None) -> List[ScanRow]:
+    # Keyset pagination: seek past the previous page's last position through an index instead of using OFFSET.
+    if order not in SCAN_ORDERS:
+        raise ValueError("Unknown scan order: {0}".format(order))
+    limit = check_page_size(limit)
+    columns = ", ".join(SCAN_ORDERS[order])
+    conditions = [NOT_EXPIRED]
+    params = [time.time() if now is None else now]
+    if after is not None:
+        conditions.append("({0}) > ({1})".format(columns, ", ".join("?" for _ in after)))
+        params.extend(after)
+    with cursor_manager(conn) as c:
+        c.execute(
+            "SELECT key, value, ring_id, expires_at FROM kv_store WHERE {0} ORDER BY {1} LIMIT ?".format(
+                " AND ".join(conditions), columns
+            ),
+            params + [limit]
+        )
+        return [
+            ScanRow(row["key"], json.loads(row["value"]), row["ring_id"], row["expires_at"]) for row in c.fetchall()
+        ]
+
+
+def scan_position(row: ScanRow, order: str) -> Tuple:
+    return tuple(getattr(row, column) for column in SCAN_ORDERS[order])
+
+
+def iter_kv_pages(conn: sqlite.Connection, order: str = "key", page_size: int = DEFAULT_PAGE_SIZE,
+                  now: Optional[float] = None) -> Iterator[List[ScanRow]]:
+    page_size = check_page_size(page_size)
+    after = None
+    while True:
+        page = scan_kv_pairs(conn, order=order, after=after, limit=page_size, now=now)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        after = scan_position(page[-1], order)
+
+
+def encode_scan_token(order: str, position: Tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps([order, list(position)]).encode("utf-8")).decode("ascii")
+
+
+def decode_scan_token(token: str) -> Tuple[str, Tuple]:
+    try:
+        order, position = json.loads(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))
+    except (ValueError, TypeError):
+        raise ValueError("Malformed scan token: {0}".format(token))
+    if not isinstance(order, str) or order not in SCAN_ORDERS or not isinstance(position, list) or \
+            len(position) != len(SCAN_ORDERS[order]) or not all(isinstance(p, str) for p in position):
+        raise ValueError("Malformed scan token: {0}".format(token))
+    return order, tuple(position)
+
+
 def remove_key(conn: sqlite.Connection, key: str):
     with cursor_manager(conn) as c:
         c.execute(
             "DELETE FROM kv_store WHERE key = ?",
             (key,)
         )
+
+
+def purge_expired_keys(conn: sqlite.Connection, limit: int = PURGE_BATCH_SIZE, now: Optional[float] = None) -> int:
+    with cursor_manager(conn) as c:
+        c.execute(
+            "DELETE FROM kv_store WHERE rowid IN "
+            "(SELECT rowid FROM kv_store WHERE expires_at <= ? LIMIT ?)",
+            (time.time() if now is None else now, limit)
+        )
+        return c.rowcount
+
+
+def incremental_vacuum(conn: sqlite.Connection, pages: int = INCREMENTAL_VACUUM_PAGES):
+    with cursor_manager(conn) as c:
+        c.execute("PRAGMA incremental_vacuum({0:d})".format(pages))
+        c.fetchall()
@@ -1,7 +1,14 @@
+from functools import lru_cache
 from hashlib import sha1
 from typing import Union
 
 INTERVAL_SIZE = 160
+DIGEST_CACHE_SIZE = 2**16
+
+
+@lru_cache(maxsize=DIGEST_CACHE_SIZE)
+def _sha1_digest(identifier: bytes) -> int:
+    return int(sha1(identifier).hexdigest(), 16)
 
 
 class SHA1Hasher(object):
@@ -15,7 +22,7 @@ class SHA1Hasher(object):
     def hash(self, identifier: Union[str, bytes]) -> int:
         if isinstance(identifier, str):
             identifier = identifier.encode("utf-8")
-        return int(sha1(identifier).hexdigest(), 16) % self.max_value
+        return _sha1_digest(identifier) % self.max_value
 
     def _convert_to_int(self, *args):
         return tuple(self.hash(a) if isinstance(a, str) else a % self.max_value for a in args)
@@ -33,3 +40,7 @@ class SHA1Hasher(object):
             return a < identifier < b
         else:
             return a < identifier or identifier < b
+
+    def distance(self, a: Union[str, int], b: Union[str, int]) -> int:
+        a, b = self._convert_to_int(a, b)
+        return (b - a) % self.max_value
@@ -4,6 +4,7 @@ import sys
 from logging.handlers import WatchedFileHandler
 
 from pychord.run_node import attach_run_node
+from pychord.simulator import attach_simulate
 
 
 LOG_FORMAT = "[%(asctime)s] - %(levelname)s - %(message)s - " \
@@ -23,6 +24,7 @@ subparsers = argument_parser.add_subparsers(title="commands", dest="command")
 subparsers.required = True
 
 attach_run_node(subparsers.add_parser("run-node"))
+attach_simulate(subparsers.add_parser("simulate"))
 
 
 def setup_logging(log_file, verbosity, enable_sigusr1_debug=False):
@@ -1,18 +1,31 @@
 import threading
 import logging
+import math
+import time
 from contextlib import contextmanager
-from typing import Union, List, Optional
+from typing import Union, List, Optional, Tuple, Dict, Any, Callable, Iterator
 
 from pychord.hashing import SHA1Hasher
 from pychord import db
 from pychord.rpc_client import remote_rpc
+from pychord.tracing import LookupTracer, LookupTraceError, next_hop
 
 
 node_logger = logging.getLogger(__name__)
 
+RTT_EWMA_WEIGHT = 0.125
+PROXIMITY_CANDIDATES = 4
+
+
+def check_ttl(ttl):
+    if ttl is not None and (isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0):
+        raise ValueError("TTL must be a positive number of seconds, got: {0!r}".format(ttl))
+
 
 class Node(object):
-    def __init__(self, address, port, db_path, hasher: SHA1Hasher, remote_addr: Optional[str] = None):
+    def __init__(self, address, port, db_path, hasher: SHA1Hasher, remote_addr: Optional[str] = None,
+                 tracer: Optional[LookupTracer] = None, rpc_factory: Callable[[str], Any] = remote_rpc,
+                 proximity_routing: bool = False, clock: Callable[[], float] = time.monotonic):
         self.local_addr = "{0}:{1}".format(address, port)
         self.db_path = db_path
         self.hasher = hasher
@@ -24,6 +37,13 @@ class Node(object):
         if remote_addr:
             self.fingers[0] = remote_addr
         self._current_check_finger_index = 1
+        self.tracer = tracer or LookupTracer()
+        self.remote_rpc = rpc_factory
+        self.purged_key_count = 0
+        self.proximity_routing = proximity_routing
+        self.clock = clock
+        self.rtt_estimates: Dict[str, float] = {}
+        self.rtt_sampled_at: Dict[str, float] = {}
 
     @property
     def next_finger_index(self) -> int:
@@ -37,9 +57,12 @@ class Node(object):
     def hashed_local_id(self):
         return self.hasher.hash(self.local_addr)
 
-    def initialize(self):
+    def initialize(self, rebuild_for_vacuum: bool = False):
         with self.get_conn() as conn:
-            db.write_schema(conn)
+            db.write_schema(conn, rebuild_for_vacuum=rebuild_for_vacuum)
+            backfilled = db.backfill_ring_ids(conn, self.hasher.hash)
+            if backfilled:
+                node_logger.info("Backfilled ring identifiers for {0} keys".format(backfilled))
         if self.remote_addr is not None:
             self.join(self.remote_addr)
         else:
@@ -52,19 +75,115 @@ class Node(object):
             try:
                 other = self.closest_preceding_node(identifier)
                 if other != self.local_addr:
-                    return remote_rpc(other).find_successor(identifier)
+                    return self.remote_rpc(other).find_successor(identifier)
                 else:
                     return self.successor
             except BaseException:
                 node_logger.exception("Failed finding successor!")
                 raise
 
-    def closest_preceding_node(self, identifier: Union[str, int]) -> str:
+    def find_successor_traced(self, identifier: Union[str, int], trace: Dict[str, Any]) -> Dict[str, Any]:
+        start = self.clock()
+        hop = {"addr": self.local_addr, "hop": trace["hop"], "finger_index": None, "to": None}
+        result = {"successor": self.successor, "hops": []}
+        if not self.hasher.in_interval_inc(identifier, self.local_addr, self.successor):
+            index, other = self.closest_preceding_finger(identifier)
+            hop["finger_index"] = index
+            if other != self.local_addr:
+                hop["to"] = other
+                # Failures are returned rather than raised so the hops traced so far reach the originating node.
+                try:
+                    sent = self.clock()
+                    result = self.remote_rpc(other).find_successor_traced(identifier, next_hop(trace))
+                    if result["hops"]:
+                        # What the next hop did not spend itself is the round trip to it.
+                        self.record_rtt(other, max(self.clock() - sent - result["hops"][0]["elapsed"], 0.0))
+                except BaseException as e:
+                    node_logger.warning("Failed finding successor for trace {0}!".format(trace["trace_id"]),
+                                        exc_info=True)
+                    result = {"successor": None, "hops": [], "error": str(e) or type(e).__name__,
+                              "failed_peer": other}
+        hop["elapsed"] = self.clock() - start
+        return dict(result, hops=[hop] + result["hops"])
+
+    def _record_trace(self, trace: Dict[str, Any], identifier: Union[str, int]) -> Dict[str, Any]:
+        result = self.find_successor_traced(identifier, trace)
+        recorded = self.tracer.record(
+            trace, identifier, result["successor"], result["hops"],
+            error=result.get("error"), failed_peer=result.get("failed_peer")
+        )
+        if recorded["error"] is not None:
+            raise LookupTraceError("Lookup for {0} failed at {1}: {2}".format(
+                identifier, recorded["failed_peer"], recorded["error"]
+            ))
+        return recorded
+
+    def lookup(self, identifier: Union[str, int]) -> str:
+        trace = self.tracer.start()
+        if trace is None:
+            return self.find_successor(identifier)
+        return self._record_trace(trace, identifier)["successor"]
+
+    def trace_lookup(self, identifier: Union[str, int]) -> Dict[str, Any]:
+        return self._record_trace(self.tracer.start(force=True), identifier)
+
+    def closest_preceding_finger(self, identifier: Union[str, int]) -> Tuple[Optional[int], str]:
+        # With proximity routing, the few farthest distinct preceding fingers compete on RTT plus remaining-hop cost.
+        candidates = []
         for i in range(self.hasher.ring_size - 1, 0, -1):
-            if self.fingers[i] is not None and \
-                    self.hasher.in_interval_exc(self.fingers[i], self.local_addr, identifier):
-                return self.fingers[i]
-        return self.local_addr
+            finger = self.fingers[i]
+            if finger is not None and (not candidates or finger != candidates[-1][1]) and \
+                    self.hasher.in_interval_exc(finger, self.local_addr, identifier):
+                candidates.append((i, finger))
+                if not self.proximity_routing or len(candidates) >= PROXIMITY_CANDIDATES:
+                    break
+        rtts = self.rtt_snapshot() if len(candidates) > 1 and self.successor is not None else {}
+        if rtts:
+            mean_rtt = sum(rtts.values()) / len(rtts)
+            return min(candidates, key=lambda c: self._routing_cost(
+                c[1], identifier, rtts.get(c[1], mean_rtt), mean_rtt
+            ))
+        return candidates[0] if candidates else (None, self.local_addr)
+
+    def _routing_cost(self, finger: str, identifier: Union[str, int], rtt: float, mean_rtt: float) -> float:
+        # Chord needs about half of log2(n) hops to cover a span holding n nodes; node density is estimated from
+        # the gap to our own successor.
+        node_gap = max(self.hasher.distance(self.local_addr, self.successor), 1)
+        nodes_remaining = self.hasher.distance(finger, identifier) / node_gap
+        return rtt + mean_rtt * max(math.log2(nodes_remaining), 0) / 2 if nodes_remaining > 1 else rtt
+
+    def record_rtt(self, addr: str, sample: float):
+        with self.lock:
+            previous = self.rtt_estimates.get(addr)
+            if previous is None:
+                self.rtt_estimates[addr] = sample
+            else:
+                self.rtt_estimates[addr] = (1 - RTT_EWMA_WEIGHT) * previous + RTT_EWMA_WEIGHT * sample
+            self.rtt_sampled_at[addr] = self.clock()
+
+    def rtt_snapshot(self) -> Dict[str, float]:
+        with self.lock:
+            return dict(self.rtt_estimates)
+
+    def forget_rtt(self, addr: str):
+        with self.lock:
+            self.rtt_estimates.pop(addr, None)
+            self.rtt_sampled_at.pop(addr, None)
+
+    def timed_rpc(self, addr: str, method: str, *args):
+        start = self.clock()
+        try:
+            result = getattr(self.remote_rpc(addr), method)(*args)
+        except BaseException:
+            # An unreachable peer's stale estimate would otherwise skew the mean RTT used for routing costs.
+            self.forget_rtt(addr)
+            raise
+        self.record_rtt(addr, self.clock() - start)
+        return result
+
+    def closest_preceding_node(self, identifier: Union[str, int]) -> str:
+        _, finger = self.closest_preceding_finger(identifier)
+        return finger
 
     def create(self):
         self.predecessor = None
@@ -73,7 +192,7 @@ class Node(object):
     def join(self, other_addr: str):
         self.predecessor = None
         try:
-            self.successor = remote_rpc(other_addr).find_successor(self.local_addr)
+            self.successor = self.remote_rpc(other_addr).find_successor(self.local_addr)
         except BaseException:
             node_logger.exception("Unable to connect to remote node and join! Aborting...")
             raise
@@ -81,13 +200,16 @@ class Node(object):
     def leave(self):
         with self.get_conn() as conn:
             if self.successor is not None and self.successor != self.local_addr:
-                bulk = db.get_all_kv_pairs(conn)
-                remote_rpc(self.successor).set_local_bulk(bulk)
+                for page in db.iter_kv_pages(conn):
+                    now = time.time()
+                    bulk = {row.key: row.value for row in page}
+                    ttls = {row.key: row.expires_at - now for row in page if row.expires_at is not None}
+                    self.remote_rpc(self.successor).set_local_bulk(bulk, ttls)
 
     def stabilize(self):
         if self.successor is not None:
             if self.successor != self.local_addr:
-                remote_predecessor = remote_rpc(self.successor).current_predecessor()
+                remote_predecessor = self.timed_rpc(self.successor, "current_predecessor")
             else:
                 remote_predecessor = self.predecessor
             if remote_predecessor and self.hasher.in_interval_exc(
@@ -96,7 +218,7 @@ class Node(object):
                 node_logger.info("Successor changed to: {0}".format(remote_predecessor))
                 self.successor = remote_predecessor
             if self.successor != self.local_addr:
-                remote_rpc(self.successor).notify(self.local_addr)
+                self.timed_rpc(self.successor, "notify", self.local_addr)
             else:
                 self.notify(self.local_addr)
 
@@ -111,13 +233,32 @@ class Node(object):
         index = self.next_finger_index
         node_id = self.hashed_local_id
         try:
-            self.fingers[index] = self.find_successor(
+            previous = self.fingers[index]
+            finger = self.fingers[index] = self.find_successor(
                 node_id + 2**index
             )
+            if self.proximity_routing and finger != self.local_addr and \
+                    (finger != previous or finger not in self.rtt_estimates):
+                self.timed_rpc(finger, "ping")
         except BaseException:
             node_logger.warning("Call to find successor failed, ejecting finger {0}".format(index), exc_info=True)
             self.fingers[index] = None
 
+    def refresh_rtt(self):
+        if not self.proximity_routing:
+            return
+        fingers = sorted({f for f in self.fingers if f is not None and f != self.local_addr})
+        if not fingers:
+            return
+        with self.lock:
+            sampled_at = dict(self.rtt_sampled_at)
+        # Unsampled fingers first, then the stalest; these are the peers routing chooses between.
+        target = min(fingers, key=lambda f: sampled_at.get(f, float("-inf")))
+        try:
+            self.timed_rpc(target, "ping")
+        except BaseException:
+            node_logger.warning("Unable to ping finger {0}.".format(target), exc_info=True)
+
     @property
     def fingers_and_ids(self):
         node_id = self.hashed_local_id
@@ -128,7 +269,7 @@ class Node(object):
     def check_predecessor(self):
         if self.predecessor and self.predecessor != self.local_addr:
             try:
-                remote_rpc(self.predecessor).ping()
+                self.timed_rpc(self.predecessor, "ping")
             except BaseException:
                 node_logger.warning("Predecessor unreachable.", exc_info=True)
                 self.predecessor = None
@@ -150,36 +291,56 @@ class Node(object):
         with self.get_conn() as conn:
             return db.get_value_by_key(conn, key, default=default)
 
-    def get_all_local(self):
-        with self.get_conn() as conn:
-            return db.get_all_kv_pairs(conn)
-
     def get(self, key):
         try:
-            appropriate_node = self.find_successor(key)
-            return remote_rpc(appropriate_node).get_local(key)
+            appropriate_node = self.lookup(key)
+            return self.remote_rpc(appropriate_node).get_local(key)
         except BaseException:
             node_logger.exception("Get for key failed!")
             raise
 
-    def set_local(self, key, value):
+    def set_local(self, key, value, ttl: Optional[float] = None):
+        check_ttl(ttl)
+        expires_at = time.time() + ttl if ttl is not None else None
         with self.get_conn() as conn:
             with db.transaction_wrapper(conn) as t:
-                return db.set_key_value_pair(t, key, value)
+                return db.set_key_value_pair(t, key, value, expires_at=expires_at, ring_id=self.hasher.hash(key))
 
-    def set(self, key, value):
+    def set(self, key, value, ttl: Optional[float] = None):
+        check_ttl(ttl)
         try:
-            appropriate_node = self.find_successor(key)
-            return remote_rpc(appropriate_node).set_local(key, value)
+            appropriate_node = self.lookup(key)
+            return self.remote_rpc(appropriate_node).set_local(key, value, ttl)
         except BaseException:
             node_logger.exception("Failed to set key!")
             raise
 
-    def set_local_bulk(self, bulk_dict):
+    def set_local_bulk(self, bulk_dict, ttls: Optional[Dict[str, float]] = None):
+        ttls = ttls or {}
+        now = time.time()
         with self.get_conn() as conn:
             with db.transaction_wrapper(conn) as t:
                 for k, v in bulk_dict.items():
-                    db.set_key_value_pair(t, k, v)
+                    expires_at = now + ttls[k] if k in ttls else None
+                    db.set_key_value_pair(t, k, v, expires_at=expires_at, ring_id=self.hasher.hash(k))
+
+    def purge_expired(self, batch_size: int = db.PURGE_BATCH_SIZE) -> int:
+        with self.get_conn() as conn:
+            with db.transaction_wrapper(conn) as t:
+                purged = db.purge_expired_keys(t, limit=batch_size)
+            if purged:
+                db.incremental_vacuum(conn)
+        with self.lock:
+            self.purged_key_count += purged
+        return purged
+
+    def expiry_stats(self):
+        with self.get_conn() as conn:
+            expired = db.get_expired_key_count(conn)
+        return {
+            "expired": expired,
+            "purged": self.purged_key_count
+        }
 
     def remove_local(self, key):
         with self.get_conn() as conn:
@@ -188,8 +349,8 @@ class Node(object):
 
     def remove(self, key):
         try:
-            appropriate_node = self.find_successor(key)
-            return remote_rpc(appropriate_node).remove_local(key)
+            appropriate_node = self.lookup(key)
+            return self.remote_rpc(appropriate_node).remove_local(key)
         except BaseException:
             node_logger.exception("Failed to remove key!")
             raise
@@ -198,12 +359,38 @@ class Node(object):
         return {
             "successor": self.successor,
             "predecessor": self.predecessor,
-            "finger_table": self.fingers
+            "finger_table": self.fingers,
+            "proximity_routing": self.proximity_routing,
+            "rtt_estimates": self.rtt_snapshot()
         }
 
     def dump_db(self):
+        # Deprecated in favour of scan_local; capped at one maximum-size page so it never loads the whole store.
+        return dict(self.scan_local(limit=db.MAX_PAGE_SIZE)["pairs"])
+
+    def scan_local(self, order: str = "key", limit: int = db.DEFAULT_PAGE_SIZE,
+                   token: Optional[str] = None) -> Dict[str, Any]:
+        limit = db.check_page_size(limit)
+        after = None
+        if token is not None:
+            token_order, after = db.decode_scan_token(token)
+            if token_order != order:
+                raise ValueError("Scan token is for {0} order, not {1}".format(token_order, order))
+        with self.get_conn() as conn:
+            page = db.scan_kv_pairs(conn, order=order, after=after, limit=limit)
+        next_token = None
+        if page and len(page) == limit:
+            next_token = db.encode_scan_token(order, db.scan_position(page[-1], order))
+        return {
+            "pairs": [[row.key, row.value] for row in page],
+            "next": next_token
+        }
+
+    def iter_local_pages(self, order: str = "key",
+                         page_size: int = db.DEFAULT_PAGE_SIZE) -> Iterator[List[Tuple[str, Any]]]:
         with self.get_conn() as conn:
-            return db.get_all_kv_pairs(conn)
+            for page in db.iter_kv_pages(conn, order=order, page_size=page_size):
+                yield [(row.key, row.value) for row in page]
 
     def get_local_pair_count(self):
         with self.get_conn() as conn:
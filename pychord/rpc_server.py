@@ -3,6 +3,7 @@ from bottle import Bottle
 import logging
 
 from pychord.node import Node
+from pychord import db
 from pychord.constants import JSON_RPC_SUBURL
 
 
@@ -28,6 +29,21 @@ def attach_rpc(app: Bottle, node: Node):
         rpc_server_logger.info("Successor: {0}".format(wat))
         return wat
 
+    @rpc_plugin.public
+    def find_successor_traced(identifier, trace):
+        rpc_server_logger.info("Finding successor for {0} (trace {1}, hop {2})".format(
+            identifier, trace["trace_id"], trace["hop"]
+        ))
+        return node.find_successor_traced(identifier, trace)
+
+    @rpc_plugin.public
+    def trace_lookup(identifier):
+        return node.trace_lookup(identifier)
+
+    @rpc_plugin.public
+    def slow_lookups():
+        return node.tracer.slow_lookups()
+
     @rpc_plugin.public
     def current_predecessor():
         return node.get_predecessor()
@@ -61,19 +77,19 @@ def attach_rpc(app: Bottle, node: Node):
         return node.get(key)
 
     @rpc_plugin.public
-    def set_local(key, value):
-        rpc_server_logger.info("Setting local key/value pair: {0}/{1}".format(key, value))
-        return node.set_local(key, value)
+    def set_local(key, value, ttl=None):
+        rpc_server_logger.info("Setting local key/value pair: {0}/{1} (ttl: {2})".format(key, value, ttl))
+        return node.set_local(key, value, ttl)
 
     @rpc_plugin.public
-    def set_local_bulk(bulk_dict):
+    def set_local_bulk(bulk_dict, ttls=None):
         rpc_server_logger.info("Setting local bulk key/value pairs...")
-        return node.set_local_bulk(bulk_dict)
+        return node.set_local_bulk(bulk_dict, ttls)
 
     @rpc_plugin.public
-    def set(key, value):
-        rpc_server_logger.info("Setting key/value pair: {0}/{1}".format(key, value))
-        return node.set(key, value)
+    def set(key, value, ttl=None):
+        rpc_server_logger.info("Setting key/value pair: {0}/{1} (ttl: {2})".format(key, value, ttl))
+        return node.set(key, value, ttl)
 
     @rpc_plugin.public
     def remove_local(key):
@@ -91,8 +107,19 @@ def attach_rpc(app: Bottle, node: Node):
 
     @rpc_plugin.public
     def dump_db():
+        rpc_server_logger.warning("dump_db is deprecated and returns at most {0} pairs, use scan_db.".format(
+            db.MAX_PAGE_SIZE
+        ))
         return node.dump_db()
 
+    @rpc_plugin.public
+    def scan_db(order="key", limit=db.DEFAULT_PAGE_SIZE, token=None):
+        return node.scan_local(order=order, limit=limit, token=token)
+
     @rpc_plugin.public
     def get_local_pair_count():
         return node.get_local_pair_count()
+
+    @rpc_plugin.public
+    def expiry_stats():
+        return node.expiry_stats()
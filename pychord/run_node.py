@@ -1,6 +1,8 @@
 from pychord.node import Node
 from pychord.hashing import SHA1Hasher
+from pychord.tracing import LookupTracer, DEFAULT_SAMPLE_RATE, DEFAULT_SLOW_THRESHOLD
 from pychord.rpc_server import attach_rpc
+from pychord.db import PURGE_BATCH_SIZE
 from pychord.views import attach_views
 
 from bottle import Bottle
@@ -14,31 +16,47 @@ from argparse import ArgumentParser
 run_node_logger = logging.getLogger(__name__)
 
 
-def build_app(address, port, db_path, remote_node=None):
+def build_app(address, port, db_path, remote_node=None, trace_sample_rate=DEFAULT_SAMPLE_RATE,
+              slow_lookup_threshold=DEFAULT_SLOW_THRESHOLD, proximity_routing=False, rebuild_for_vacuum=False):
     app = Bottle()
-    node = Node(address, port, db_path, SHA1Hasher(), remote_addr=remote_node)
-    node.initialize()
+    tracer = LookupTracer(sample_rate=trace_sample_rate, slow_threshold=slow_lookup_threshold)
+    node = Node(
+        address, port, db_path, SHA1Hasher(), remote_addr=remote_node, tracer=tracer,
+        proximity_routing=proximity_routing
+    )
+    node.initialize(rebuild_for_vacuum=rebuild_for_vacuum)
     attach_rpc(app, node)
     attach_views(app, node)
     return app, node
 
 
-def background_worker(node: Node, shutdown_event: threading.Event):
+def background_worker(node: Node, shutdown_event: threading.Event, purge_batch_size: int = PURGE_BATCH_SIZE):
     while not shutdown_event.is_set():
         run_node_logger.debug("Running background tasks...")
         node.stabilize()
+        node.refresh_rtt()
         time.sleep(1)
         for _ in range(4):
             node.fix_fingers()
         time.sleep(1)
         node.check_predecessor()
+        try:
+            node.purge_expired(purge_batch_size)
+        except BaseException:
+            run_node_logger.warning("Purging expired keys failed.", exc_info=True)
         time.sleep(1)
 
 
-def run_node(node_address, bind_address, port, db_path, remote_node=None):
-    app, node = build_app(node_address, port, db_path, remote_node=remote_node)
+def run_node(node_address, bind_address, port, db_path, remote_node=None, trace_sample_rate=DEFAULT_SAMPLE_RATE,
+             slow_lookup_threshold=DEFAULT_SLOW_THRESHOLD, proximity_routing=False, rebuild_for_vacuum=False,
+             purge_batch_size=PURGE_BATCH_SIZE):
+    app, node = build_app(
+        node_address, port, db_path, remote_node=remote_node, trace_sample_rate=trace_sample_rate,
+        slow_lookup_threshold=slow_lookup_threshold, proximity_routing=proximity_routing,
+        rebuild_for_vacuum=rebuild_for_vacuum
+    )
     shutdown_event = threading.Event()
-    t = threading.Thread(target=background_worker, args=(node, shutdown_event))
+    t = threading.Thread(target=background_worker, args=(node, shutdown_event, purge_batch_size))
     t.start()
     try:
         run_node_logger.info("Started...")
@@ -57,7 +75,12 @@ def attach_run_node(subparser: ArgumentParser):
             args.bind_address,
             args.port,
             args.db_path,
-            remote_node=args.remote_node
+            remote_node=args.remote_node,
+            trace_sample_rate=args.trace_sample_rate,
+            slow_lookup_threshold=args.slow_lookup_threshold,
+            proximity_routing=args.proximity_routing,
+            rebuild_for_vacuum=args.rebuild_for_vacuum,
+            purge_batch_size=args.purge_batch_size
         )
 
     subparser.set_defaults(func=func)
@@ -66,3 +89,28 @@ def attach_run_node(subparser: ArgumentParser):
     subparser.add_argument("-b", "--bind-address", default="localhost")
     subparser.add_argument("-p", "--port", type=int, default=8080)
     subparser.add_argument("--remote-node", type=str, default=None)
+    subparser.add_argument(
+        "--trace-sample-rate", type=float, default=DEFAULT_SAMPLE_RATE,
+        help="Fraction of lookups to trace hop by hop. Default: {0}".format(DEFAULT_SAMPLE_RATE)
+    )
+    subparser.add_argument(
+        "--slow-lookup-threshold", type=float, default=DEFAULT_SLOW_THRESHOLD,
+        help="Traced lookups slower than this many seconds are kept as slow. Default: {0}".format(
+            DEFAULT_SLOW_THRESHOLD
+        )
+    )
+    subparser.add_argument(
+        "--proximity-routing", action="store_true",
+        help="Prefer lower-latency fingers among those making comparable progress around the ring."
+    )
+    subparser.add_argument(
+        "--rebuild-for-vacuum", action="store_true",
+        help="Run a one-time VACUUM at startup so a database created by an older version can reclaim space from "
+             "purged keys. Needs free disk roughly equal to the database size."
+    )
+    subparser.add_argument(
+        "--purge-batch-size", type=int, default=PURGE_BATCH_SIZE,
+        help="Maximum expired keys deleted per background cycle (about 3 seconds). Default: {0}".format(
+            PURGE_BATCH_SIZE
+        )
+    )
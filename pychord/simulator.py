@@ -0,0 +1,408 @@
+import heapq
+import itertools
+import json
+import logging
+import random
+import time
+from argparse import ArgumentParser
+from bisect import bisect_left, insort
+from collections import Counter
+from functools import partial
+from typing import Callable, Dict, List, Optional, Any, Tuple
+
+from pychord.hashing import SHA1Hasher, INTERVAL_SIZE
+from pychord.node import Node
+
+
+simulator_logger = logging.getLogger(__name__)
+
+SIM_PORT = 8080
+# Proximity routing pings one finger per stabilize round, so its estimates cover the ~log2(N) distinct fingers only
+# after that many rounds; measuring earlier understates the gain.
+DEFAULT_WARM_UP = 60.0
+# Maps RPC names to the Node methods rpc_server.attach_rpc dispatches them to, where the two differ.
+RPC_METHODS = {
+    "current_predecessor": "get_predecessor",
+    "get_local": "get_local_key",
+}
+# Simulated nodes route only; their db_path is a throwaway in-memory database, so storage calls must not look like
+# they succeeded.
+STORAGE_RPCS = {
+    "get", "get_local", "has_local_key", "set", "set_local", "set_local_bulk", "remove", "remove_local",
+    "dump_db", "scan_db", "get_local_pair_count", "expiry_stats",
+}
+
+
+class SimulatedRPCError(Exception):
+    pass
+
+
+class VirtualClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self._queue = []
+        self._counter = itertools.count()
+
+    def schedule(self, delay: float, callback: Callable, *args):
+        heapq.heappush(self._queue, (self.now + delay, next(self._counter), callback, args))
+
+    def run_until(self, end_time: float):
+        while self._queue and self._queue[0][0] <= end_time:
+            self.now, _, callback, args = heapq.heappop(self._queue)
+            callback(*args)
+        self.now = end_time
+
+
+def constant_latency(rtt: float) -> Callable[[str, str], float]:
+    return lambda src, dst: rtt
+
+
+def uniform_latency(low: float, high: float, rng: random.Random) -> Callable[[str, str], float]:
+    return lambda src, dst: rng.uniform(low, high)
+
+
+# Stable round trip time per pair of peers, so repeated calls between the same two nodes see the same latency.
+def pairwise_latency(low: float, high: float, seed: int = 0) -> Callable[[str, str], float]:
+    def latency(src, dst):
+        a, b = sorted((src, dst))
+        return random.Random("{0}|{1}|{2}".format(seed, a, b)).uniform(low, high)
+    return latency
+
+
+# Peers are spread over racks; round trips within a rack cost local_rtt and across racks remote_rtt.
+def rack_latency(racks: int, local_rtt: float, remote_rtt: float, seed: int = 0) -> Callable[[str, str], float]:
+    def rack(addr):
+        return random.Random("{0}|{1}".format(seed, addr)).randrange(racks)
+
+    def latency(src, dst):
+        return local_rtt if rack(src) == rack(dst) else remote_rtt
+    return latency
+
+
+# RPC chains run to completion at the virtual instant they start; the round trip times they would have taken are
+# accumulated on the network so the caller can attribute them to the operation being measured.
+class SimulatedNetwork(object):
+    def __init__(self, latency: Callable[[str, str], float], loss_rate: float = 0.0, timeout: float = 1.0,
+                 max_hops: int = 64, rng: Optional[random.Random] = None):
+        self.latency = latency
+        self.loss_rate = loss_rate
+        self.timeout = timeout
+        self.max_hops = max_hops
+        self.rng = rng or random.Random()
+        self.nodes: Dict[str, Node] = {}
+        self.rpc_count = 0
+        self.op_latency = 0.0
+        self.op_hops = 0
+
+    def attach(self, node: Node):
+        self.nodes[node.local_addr] = node
+
+    def detach(self, addr: str):
+        self.nodes.pop(addr, None)
+
+    def rpc_factory(self, src: str) -> Callable[[str], "SimulatedProxy"]:
+        return partial(SimulatedProxy, self, src)
+
+    def begin_operation(self):
+        self.op_latency = 0.0
+        self.op_hops = 0
+
+    def call(self, src: str, dst: str, method: str, args: Tuple) -> Any:
+        if method in STORAGE_RPCS:
+            raise SimulatedRPCError("RPC {0} needs storage, which simulated nodes do not have".format(method))
+        self.rpc_count += 1
+        if method in ("find_successor", "find_successor_traced"):
+            self.op_hops += 1
+            if self.op_hops > self.max_hops:
+                raise SimulatedRPCError("Lookup exceeded {0} hops".format(self.max_hops))
+        node = self.nodes.get(dst)
+        if node is None or self.rng.random() < self.loss_rate:
+            self.op_latency += self.timeout
+            raise SimulatedRPCError("RPC {0} from {1} to {2} timed out".format(method, src, dst))
+        self.op_latency += self.latency(src, dst)
+        if method == "ping":
+            return "pong"
+        return getattr(node, RPC_METHODS.get(method, method))(*args)
+
+
+class SimulatedProxy(object):
+    def __init__(self, network: SimulatedNetwork, src: str, dst: str):
+        self.network = network
+        self.src = src
+        self.dst = dst
+
+    def __getattr__(self, method):
+        return lambda *args: self.network.call(self.src, self.dst, method, args)
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+# Maintenance intervals default to run_node.background_worker's cadence.
+class RingSimulator(object):
+    def __init__(self, network: SimulatedNetwork, hasher: Optional[SHA1Hasher] = None, seed: Optional[int] = None,
+                 stabilize_interval: float = 3.0, fix_fingers_interval: float = 0.75,
+                 check_predecessor_interval: float = 3.0, lookup_rate: float = 10.0,
+                 join_rate: float = 0.0, fail_rate: float = 0.0, proximity_routing: bool = False):
+        self.network = network
+        self.hasher = hasher or SHA1Hasher()
+        self.rng = random.Random(seed)
+        self.clock = VirtualClock()
+        self.stabilize_interval = stabilize_interval
+        self.fix_fingers_interval = fix_fingers_interval
+        self.check_predecessor_interval = check_predecessor_interval
+        self.lookup_rate = lookup_rate
+        self.join_rate = join_rate
+        self.fail_rate = fail_rate
+        self.proximity_routing = proximity_routing
+        self._ring: List[Tuple[int, str]] = []
+        self._alive: List[str] = []
+        self._next_index = 0
+        self.hop_counts = Counter()
+        self.lookup_latencies: List[float] = []
+        self.lookup_failures = 0
+        self.maintenance_failures = 0
+        self.convergence_times: List[float] = []
+        self.unconverged_since: Optional[float] = None
+
+    @property
+    def nodes(self) -> Dict[str, Node]:
+        return self.network.nodes
+
+    def virtual_time(self) -> float:
+        # Within an operation, the RTTs accumulated so far stand in for the time that would have passed.
+        return self.clock.now + self.network.op_latency
+
+    def _new_node(self, remote_addr: Optional[str] = None) -> Node:
+        address = "sim-{0}".format(self._next_index)
+        self._next_index += 1
+        local_addr = "{0}:{1}".format(address, SIM_PORT)
+        node = Node(
+            address, SIM_PORT, ":memory:", self.hasher, remote_addr=remote_addr,
+            rpc_factory=self.network.rpc_factory(local_addr), proximity_routing=self.proximity_routing,
+            clock=self.virtual_time
+        )
+        self.network.attach(node)
+        insort(self._ring, (node.hashed_local_id, node.local_addr))
+        self._alive.append(node.local_addr)
+        return node
+
+    def _remove_node(self, addr: str):
+        node = self.network.nodes[addr]
+        self.network.detach(addr)
+        self._ring.remove((node.hashed_local_id, addr))
+        self._alive.remove(addr)
+
+    def true_successor(self, identifier: int) -> str:
+        index = bisect_left(self._ring, (identifier % self.hasher.max_value, ""))
+        return self._ring[index % len(self._ring)][1]
+
+    def is_converged(self) -> bool:
+        return all(
+            self.nodes[addr].successor == self._ring[(i + 1) % len(self._ring)][1]
+            for i, (_, addr) in enumerate(self._ring)
+        )
+
+    def bootstrap(self, count: int, converged: bool = True):
+        # A converged ring starts with exact successors, predecessors and fingers; otherwise nodes join one by one.
+        if converged:
+            for _ in range(count):
+                self._new_node()
+            for i, (node_id, addr) in enumerate(self._ring):
+                node = self.nodes[addr]
+                node.successor = self._ring[(i + 1) % len(self._ring)][1]
+                node.predecessor = self._ring[i - 1][1]
+                node.fingers = [self.true_successor(node_id + 2**j) for j in range(self.hasher.ring_size)]
+        else:
+            first = self._new_node()
+            first.create()
+            for _ in range(count - 1):
+                self.network.begin_operation()
+                self._new_node(first.local_addr).join(first.local_addr)
+            self.unconverged_since = self.clock.now
+        for addr in list(self._alive):
+            self._schedule_maintenance(addr)
+
+    def _schedule_maintenance(self, addr: str):
+        node = self.nodes[addr]
+        for interval, task in (
+            (self.stabilize_interval, node.stabilize),
+            (self.fix_fingers_interval, node.fix_fingers),
+            (self.check_predecessor_interval, node.check_predecessor),
+            (self.stabilize_interval, node.refresh_rtt),
+        ):
+            self.clock.schedule(self.rng.uniform(0, interval), self._periodic, addr, interval, task)
+
+    def _periodic(self, addr: str, interval: float, task: Callable):
+        if addr not in self.nodes:
+            return
+        self.network.begin_operation()
+        try:
+            task()
+        except BaseException:
+            self.maintenance_failures += 1
+        self.clock.schedule(interval, self._periodic, addr, interval, task)
+
+    def _join_event(self):
+        if self._alive:
+            bootstrap_addr = self.rng.choice(self._alive)
+            node = self._new_node(bootstrap_addr)
+            self.network.begin_operation()
+            try:
+                node.join(bootstrap_addr)
+            except BaseException:
+                self.maintenance_failures += 1
+                self._remove_node(node.local_addr)
+            else:
+                self._schedule_maintenance(node.local_addr)
+                self._mark_changed()
+        self.clock.schedule(self.rng.expovariate(self.join_rate), self._join_event)
+
+    def _fail_event(self):
+        if len(self._alive) > 1:
+            self._remove_node(self.rng.choice(self._alive))
+            self._mark_changed()
+        self.clock.schedule(self.rng.expovariate(self.fail_rate), self._fail_event)
+
+    def _mark_changed(self):
+        if self.unconverged_since is None:
+            self.unconverged_since = self.clock.now
+
+    def _convergence_check(self):
+        if self.unconverged_since is not None and self.is_converged():
+            self.convergence_times.append(self.clock.now - self.unconverged_since)
+            self.unconverged_since = None
+        self.clock.schedule(self.stabilize_interval, self._convergence_check)
+
+    def lookup(self, identifier: Optional[int] = None, origin: Optional[str] = None) -> bool:
+        if identifier is None:
+            identifier = self.rng.randrange(self.hasher.max_value)
+        node = self.nodes[origin or self.rng.choice(self._alive)]
+        self.network.begin_operation()
+        try:
+            found = node.find_successor(identifier)
+        except BaseException:
+            found = None
+        succeeded = found == self.true_successor(identifier)
+        if succeeded:
+            self.hop_counts[self.network.op_hops] += 1
+            self.lookup_latencies.append(self.network.op_latency)
+        else:
+            self.lookup_failures += 1
+        return succeeded
+
+    def _lookup_event(self):
+        self.lookup()
+        self.clock.schedule(self.rng.expovariate(self.lookup_rate), self._lookup_event)
+
+    def warm_up(self, duration: float):
+        self.clock.run_until(self.clock.now + duration)
+
+    def run(self, duration: float) -> Dict[str, Any]:
+        started = time.monotonic()
+        if self.lookup_rate > 0:
+            self.clock.schedule(self.rng.expovariate(self.lookup_rate), self._lookup_event)
+        if self.join_rate > 0:
+            self.clock.schedule(self.rng.expovariate(self.join_rate), self._join_event)
+        if self.fail_rate > 0:
+            self.clock.schedule(self.rng.expovariate(self.fail_rate), self._fail_event)
+        self.clock.schedule(0, self._convergence_check)
+        self.clock.run_until(self.clock.now + duration)
+        return self.report(time.monotonic() - started)
+
+    def report(self, wall_time: Optional[float] = None) -> Dict[str, Any]:
+        lookups = sum(self.hop_counts.values()) + self.lookup_failures
+        latencies = sorted(self.lookup_latencies)
+        return {
+            "nodes": len(self._alive),
+            "proximity_routing": self.proximity_routing,
+            "virtual_time": self.clock.now,
+            "wall_time": wall_time,
+            "lookups": lookups,
+            "lookup_failures": self.lookup_failures,
+            "failure_rate": self.lookup_failures / lookups if lookups else None,
+            "hop_counts": dict(sorted(self.hop_counts.items())),
+            "mean_hops": sum(h * c for h, c in self.hop_counts.items()) / len(latencies) if latencies else None,
+            "lookup_latency": {
+                "mean": sum(latencies) / len(latencies) if latencies else None,
+                "p50": _percentile(latencies, 0.5),
+                "p99": _percentile(latencies, 0.99),
+            },
+            "rpc_count": self.network.rpc_count,
+            "maintenance_failures": self.maintenance_failures,
+            "convergence_times": self.convergence_times,
+            "converged": self.unconverged_since is None,
+        }
+
+
+def simulate(nodes, duration, ring_bits=INTERVAL_SIZE, seed=None, converged=True, latency_low=0.001,
+             latency_high=0.05, racks=None, loss_rate=0.0, lookup_rate=10.0, join_rate=0.0, fail_rate=0.0,
+             proximity_routing=False, warm_up=DEFAULT_WARM_UP) -> Dict[str, Any]:
+    if racks:
+        latency = rack_latency(racks, latency_low, latency_high, seed=seed or 0)
+    else:
+        latency = pairwise_latency(latency_low, latency_high, seed=seed or 0)
+    network = SimulatedNetwork(latency, loss_rate=loss_rate, rng=random.Random(seed))
+    simulator = RingSimulator(
+        network, hasher=SHA1Hasher(size=ring_bits), seed=seed, lookup_rate=lookup_rate,
+        join_rate=join_rate, fail_rate=fail_rate, proximity_routing=proximity_routing
+    )
+    simulator.bootstrap(nodes, converged=converged)
+    simulator.warm_up(warm_up)
+    return simulator.run(duration)
+
+
+def attach_simulate(subparser: ArgumentParser):
+    def func(args):
+        if args.verbose < 2:
+            # Every failed RPC is logged by the nodes themselves, which drowns the run under churn or loss.
+            logging.getLogger("pychord.node").setLevel(logging.CRITICAL)
+        print(json.dumps(simulate(
+            args.nodes,
+            args.duration,
+            ring_bits=args.ring_bits,
+            seed=args.seed,
+            converged=not args.join,
+            latency_low=args.latency_low,
+            latency_high=args.latency_high,
+            racks=args.racks,
+            loss_rate=args.loss_rate,
+            lookup_rate=args.lookup_rate,
+            join_rate=args.join_rate,
+            fail_rate=args.fail_rate,
+            proximity_routing=args.proximity_routing,
+            warm_up=args.warm_up,
+        ), indent=2))
+
+    subparser.set_defaults(func=func)
+    subparser.add_argument("-N", "--nodes", type=int, default=1000)
+    subparser.add_argument("-d", "--duration", type=float, default=60.0, help="Virtual seconds to simulate.")
+    subparser.add_argument("--ring-bits", type=int, default=INTERVAL_SIZE)
+    subparser.add_argument("--seed", type=int, default=None)
+    subparser.add_argument(
+        "--join", action="store_true", help="Build the ring by sequential joins instead of starting converged."
+    )
+    subparser.add_argument(
+        "--latency-low", type=float, default=0.001, help="Minimum RTT in seconds, or the in-rack RTT with --racks."
+    )
+    subparser.add_argument(
+        "--latency-high", type=float, default=0.05, help="Maximum RTT in seconds, or the cross-rack RTT with --racks."
+    )
+    subparser.add_argument(
+        "--racks", type=int, default=None, help="Spread nodes over this many racks instead of random pairwise RTTs."
+    )
+    subparser.add_argument("--loss-rate", type=float, default=0.0, help="Fraction of RPCs that time out.")
+    subparser.add_argument("--lookup-rate", type=float, default=10.0, help="Lookups per virtual second.")
+    subparser.add_argument("--join-rate", type=float, default=0.0, help="Node joins per virtual second.")
+    subparser.add_argument("--fail-rate", type=float, default=0.0, help="Node failures per virtual second.")
+    subparser.add_argument(
+        "--proximity-routing", action="store_true", help="Enable latency-aware finger selection on every node."
+    )
+    subparser.add_argument(
+        "--warm-up", type=float, default=DEFAULT_WARM_UP,
+        help="Virtual seconds of maintenance to run before measuring lookups. Proximity routing needs this to sample "
+             "its fingers' RTTs."
+    )
@@ -0,0 +1,76 @@
+import datetime
+import random
+import threading
+import uuid
+from collections import deque
+from typing import Optional, List, Dict, Any
+
+
+DEFAULT_SAMPLE_RATE = 0.0
+DEFAULT_SLOW_THRESHOLD = 0.25
+DEFAULT_MAX_RECORDS = 100
+
+
+class LookupTraceError(Exception):
+    pass
+
+
+def new_trace() -> Dict[str, Any]:
+    return {"trace_id": uuid.uuid4().hex, "hop": 0}
+
+
+def next_hop(trace: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(trace, hop=trace["hop"] + 1)
+
+
+def hop_latencies(hops: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # A hop's elapsed time includes everything downstream; what is left is the round trip to its "to" peer.
+    result = []
+    for i, hop in enumerate(hops):
+        downstream = hops[i + 1]["elapsed"] if i + 1 < len(hops) else 0.0
+        result.append(dict(hop, latency=max(hop["elapsed"] - downstream, 0.0)))
+    return result
+
+
+class LookupTracer(object):
+    def __init__(self, sample_rate: float = DEFAULT_SAMPLE_RATE, slow_threshold: float = DEFAULT_SLOW_THRESHOLD,
+                 max_records: int = DEFAULT_MAX_RECORDS):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=max_records)
+        self.slow = deque(maxlen=max_records)
+
+    def start(self, force: bool = False) -> Optional[Dict[str, Any]]:
+        if force or (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return new_trace()
+        return None
+
+    def record(self, trace: Dict[str, Any], identifier, successor: Optional[str], hops: List[Dict[str, Any]],
+               error: Optional[str] = None, failed_peer: Optional[str] = None) -> Dict[str, Any]:
+        hops = hop_latencies(hops)
+        total = hops[0]["elapsed"] if hops else 0.0
+        lookup = {
+            "trace_id": trace["trace_id"],
+            "identifier": str(identifier),
+            "successor": successor,
+            "started": datetime.datetime.now().isoformat(),
+            "total": total,
+            "hop_count": sum(1 for hop in hops if hop["to"] is not None),
+            "hops": hops,
+            "error": error,
+            "failed_peer": failed_peer,
+        }
+        with self.lock:
+            self.recent.append(lookup)
+            if error is not None or total >= self.slow_threshold:
+                self.slow.append(lookup)
+        return lookup
+
+    def recent_lookups(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return list(reversed(self.recent))
+
+    def slow_lookups(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return list(reversed(self.slow))
@@ -1,9 +1,9 @@
-from bottle import Bottle, static_file, SimpleTemplate, json_dumps, response
+from bottle import Bottle, static_file, SimpleTemplate, json_dumps, response, request, abort
 import logging
 import datetime
 
 from pychord.node import Node
-from pychord import STATIC_FILES_DIR
+from pychord import STATIC_FILES_DIR, db
 
 
 views_logger = logging.getLogger(__name__)
@@ -31,6 +31,9 @@ auto;max-width:650px;line-height:1.6;font-size:18px;color:#444;padding:0
             <li>Predecessor: {{ node.predecessor }}</li>
             <li>Successor: {{ node.successor }}</li>
             <li>Local K/V count: {{ node.get_local_pair_count() }}</li>
+            % expiry = node.expiry_stats()
+            <li>Expired keys awaiting purge: {{ expiry["expired"] }}</li>
+            <li>Expired keys purged: {{ expiry["purged"] }}</li>
             <li>Hashed ID: {{ node.hashed_local_id }}</li>
         </ul>
         <h2>Fingers:</h2>
@@ -39,6 +42,43 @@ auto;max-width:650px;line-height:1.6;font-size:18px;color:#444;padding:0
             <li>{{ finger }} ({{ident}})</li>
         % end
         </ul>
+        <p><a href="/slow-lookups">Recent slow lookups</a></p>
+    </body>
+</html>
+    """
+)
+
+slow_lookups_template = SimpleTemplate(
+    """
+<html>
+    <head>
+        <title>Pychord Node - Slow Lookups</title>
+        <style>
+body{margin:40px
+auto;max-width:650px;line-height:1.6;font-size:18px;color:#444;padding:0
+10px}h1,h2,h3{line-height:1.2}
+        </style>
+    </head>
+    <body>
+        <h1>Slow lookups on {{ node.local_addr }}</h1>
+        <p>Sample rate: {{ node.tracer.sample_rate }}, threshold: {{ node.tracer.slow_threshold }}s</p>
+        % for lookup in lookups:
+        <h3>{{ lookup["identifier"] }} &rarr; {{ lookup["successor"] }}</h3>
+        <p>Trace {{ lookup["trace_id"] }} at {{ lookup["started"] }}: {{ "%.4f" % lookup["total"] }}s
+        over {{ lookup["hop_count"] }} RPC hops</p>
+        % if lookup["error"] is not None:
+        <p>Failed reaching {{ lookup["failed_peer"] }}: {{ lookup["error"] }}</p>
+        % end
+        <ol>
+        % for hop in lookup["hops"]:
+            % if hop["to"] is None:
+            <li>{{ hop["addr"] }} answered: {{ "%.4f" % hop["latency"] }}s</li>
+            % else:
+            <li>{{ hop["to"] }} (finger {{ hop["finger_index"] }} of {{ hop["addr"] }}): {{ "%.4f" % hop["latency"] }}s</li>
+            % end
+        % end
+        </ol>
+        % end
     </body>
 </html>
     """
@@ -54,10 +94,45 @@ def attach_views(app: Bottle, node: Node):
             uptime=(datetime.datetime.now() - start_time).total_seconds(),
         )
 
+    @app.route("/slow-lookups")
+    def slow_lookups_view():
+        return slow_lookups_template.render(node=node, lookups=node.tracer.slow_lookups())
+
+    @app.route("/slow-lookups.json")
+    def slow_lookups_json():
+        response.content_type = "application/json"
+        return json_dumps(node.tracer.slow_lookups())
+
+    def scan_order():
+        order = request.query.get("order", "key")
+        if order not in db.SCAN_ORDERS:
+            abort(400, "Unknown scan order: {0}".format(order))
+        return order
+
+    def stream_db_dump(order):
+        yield "{"
+        separator = ""
+        for page in node.iter_local_pages(order=order):
+            yield separator + ", ".join("{0}: {1}".format(json_dumps(k), json_dumps(v)) for k, v in page)
+            separator = ", "
+        yield "}"
+
     @app.route("/db-dump")
     def db_dump():
+        order = scan_order()
+        response.content_type = "application/json"
+        return stream_db_dump(order)
+
+    @app.route("/db-scan")
+    def db_scan():
+        order = scan_order()
+        try:
+            limit = int(request.query.get("limit", db.DEFAULT_PAGE_SIZE))
+            page = node.scan_local(order=order, limit=limit, token=request.query.get("token") or None)
+        except ValueError as e:
+            abort(400, str(e))
         response.content_type = "application/json"
-        return json_dumps(node.get_all_local())
+        return json_dumps(page)
 
     @app.route("/static/<fname:path>")
     def static_file_handler(fname):
@@ -1,9 +1,11 @@
 import tempfile
+import random
 import pytest
 import os
 
 from pychord.hashing import SHA1Hasher, INTERVAL_SIZE
 from pychord.db import open_conn, write_schema
+from pychord.simulator import RingSimulator, SimulatedNetwork, constant_latency
 
 
 @pytest.fixture
@@ -29,3 +31,17 @@ def interval_size():
 @pytest.fixture
 def hasher(interval_size):
     return SHA1Hasher(size=interval_size)
+
+
+@pytest.fixture
+def ring(request):
+    # Parametrise indirectly with a dict to override any of these.
+    options = dict(
+        {"nodes": 256, "ring_bits": 32, "latency": constant_latency(0.01), "seed": 5, "converged": True},
+        **getattr(request, "param", {})
+    )
+    network = SimulatedNetwork(options.pop("latency"), rng=random.Random(options["seed"]))
+    nodes, converged = options.pop("nodes"), options.pop("converged")
+    simulator = RingSimulator(network, hasher=SHA1Hasher(size=options.pop("ring_bits")), **options)
+    simulator.bootstrap(nodes, converged=converged)
+    return simulator
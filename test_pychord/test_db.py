@@ -1,5 +1,12 @@
+import base64
+import json
+
+import pytest
+
 from pychord.db import get_value_by_key, does_key_exist, set_key_value_pair, remove_key, get_all_kv_pairs, \
-    transaction_wrapper
+    transaction_wrapper, get_kv_pair_count, get_expired_key_count, purge_expired_keys, \
+    incremental_vacuum, open_conn, write_schema, scan_kv_pairs, scan_position, iter_kv_pages, encode_scan_token, \
+    decode_scan_token, backfill_ring_ids, format_ring_id, MAX_PAGE_SIZE
 
 
 def test_db_crud(database_conn):
@@ -32,3 +39,100 @@ def test_db_crud(database_conn):
     assert not get_all_kv_pairs(database_conn)
     assert not does_key_exist(database_conn, "foo")
     assert not get_value_by_key(database_conn, "foo")
+
+
+def test_db_expiry(database_conn):
+    with transaction_wrapper(database_conn) as t:
+        set_key_value_pair(t, "forever", 1)
+        set_key_value_pair(t, "short", 2, expires_at=100.0)
+        set_key_value_pair(t, "long", 3, expires_at=200.0)
+
+    assert get_value_by_key(database_conn, "short", now=50.0) == 2
+    assert get_value_by_key(database_conn, "short", now=0.0) == 2
+    assert get_kv_pair_count(database_conn, now=0.0) == 3
+    assert get_value_by_key(database_conn, "short", now=150.0) is None
+    assert not does_key_exist(database_conn, "short", now=150.0)
+    assert get_all_kv_pairs(database_conn, now=150.0) == {"forever": 1, "long": 3}
+    assert get_kv_pair_count(database_conn, now=150.0) == 2
+    assert [row.expires_at for row in scan_kv_pairs(database_conn, now=150.0)] == [None, 200.0]
+    assert get_expired_key_count(database_conn, now=250.0) == 2
+
+    with transaction_wrapper(database_conn) as t:
+        assert purge_expired_keys(t, limit=1, now=250.0) == 1
+    with transaction_wrapper(database_conn) as t:
+        assert purge_expired_keys(t, limit=1, now=250.0) == 1
+        assert purge_expired_keys(t, limit=1, now=250.0) == 0
+    incremental_vacuum(database_conn)
+
+    assert get_expired_key_count(database_conn, now=250.0) == 0
+    assert get_all_kv_pairs(database_conn, now=250.0) == {"forever": 1}
+
+
+def test_write_schema_new_database_uses_incremental_vacuum(database_conn):
+    assert database_conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_write_schema_adds_expiry_column(database_path):
+    conn = open_conn(database_path)
+    conn.executescript("CREATE TABLE kv_store(key TEXT PRIMARY KEY NOT NULL, value TEXT NOT NULL);")
+    conn.execute("INSERT INTO kv_store(key, value) VALUES ('foo', '\"bar\"')")
+    conn.commit()
+
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+
+    write_schema(conn)
+    write_schema(conn)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    assert get_value_by_key(conn, "foo") == "bar"
+
+    write_schema(conn, rebuild_for_vacuum=True)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert get_value_by_key(conn, "foo") == "bar"
+    assert [row.expires_at for row in scan_kv_pairs(conn)] == [None]
+
+
+def test_db_scan_pages(database_conn, hasher):
+    keys = ["key-{0:02d}".format(i) for i in range(25)]
+    with transaction_wrapper(database_conn) as t:
+        for key in keys:
+            set_key_value_pair(t, key, {"k": key}, ring_id=hasher.hash(key))
+        set_key_value_pair(t, "expired", 1, expires_at=1.0, ring_id=hasher.hash("expired"))
+
+    pages = list(iter_kv_pages(database_conn, page_size=10))
+    assert [len(p) for p in pages] == [10, 10, 5]
+    assert [row.key for page in pages for row in page] == keys
+    assert pages[0][0].value == {"k": "key-00"}
+
+    ring_order = [row.key for page in iter_kv_pages(database_conn, order="ring_id", page_size=7) for row in page]
+    assert ring_order == sorted(keys, key=hasher.hash)
+
+    first = scan_kv_pairs(database_conn, order="ring_id", limit=3)
+    order, position = decode_scan_token(encode_scan_token("ring_id", scan_position(first[-1], "ring_id")))
+    rest = scan_kv_pairs(database_conn, order=order, after=position, limit=100)
+    assert [row.key for row in first + rest] == ring_order
+
+    with pytest.raises(ValueError):
+        scan_kv_pairs(database_conn, order="value")
+    for limit in (0, -1):
+        with pytest.raises(ValueError):
+            scan_kv_pairs(database_conn, limit=limit)
+        with pytest.raises(ValueError):
+            list(iter_kv_pages(database_conn, page_size=limit))
+    assert len(scan_kv_pairs(database_conn, limit=MAX_PAGE_SIZE + 1)) == 25
+
+    with pytest.raises(ValueError):
+        decode_scan_token("not-a-token")
+    for malformed in (["key", 5], ["key", ["a", "b"]], ["ring_id", ["a", 1]], [["key"], ["a"]], "key"):
+        with pytest.raises(ValueError):
+            decode_scan_token(base64.urlsafe_b64encode(json.dumps(malformed).encode("utf-8")).decode("ascii"))
+
+
+def test_backfill_ring_ids(database_conn, hasher):
+    with transaction_wrapper(database_conn) as t:
+        for i in range(5):
+            set_key_value_pair(t, "key-{0}".format(i), i)
+
+    assert backfill_ring_ids(database_conn, hasher.hash, batch_size=2) == 5
+    assert backfill_ring_ids(database_conn, hasher.hash) == 0
+    rows = scan_kv_pairs(database_conn, order="ring_id")
+    assert [row.ring_id for row in rows] == sorted(format_ring_id(hasher.hash(row.key)) for row in rows)
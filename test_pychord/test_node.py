@@ -0,0 +1,155 @@
+import base64
+import json
+import sqlite3
+import threading
+import time
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+from bottle import Bottle
+from webtest import TestApp
+
+from pychord import db, run_node
+from pychord.node import Node
+from pychord.views import attach_views
+
+
+@pytest.fixture
+def node(database_path, hasher):
+    node = Node("localhost", 8080, database_path, hasher)
+    node.initialize()
+    return node
+
+
+def test_set_local_ttl(node):
+    node.set_local("session", {"user": 1}, ttl=60)
+    node.set_local("forever", 1)
+    assert node.get_local_key("session") == {"user": 1}
+    assert node.get_local_pair_count() == 2
+    assert node.expiry_stats() == {"expired": 0, "purged": 0}
+
+
+@pytest.mark.parametrize("ttl", [0, -1, -0.5, "60", True, [60]])
+def test_set_local_rejects_invalid_ttl(node, ttl):
+    with pytest.raises(ValueError):
+        node.set_local("session", 1, ttl=ttl)
+    with pytest.raises(ValueError):
+        node.set("session", 1, ttl=ttl)
+    assert not node.has_local_key("session")
+
+
+def test_db_scan_view(node):
+    app = Bottle()
+    attach_views(app, node)
+    client = TestApp(app)
+    for i in range(5):
+        node.set_local("key-{0}".format(i), i)
+
+    page = client.get("/db-scan", {"limit": 2}).json
+    assert page["pairs"] == [["key-0", 0], ["key-1", 1]]
+    rest = client.get("/db-scan", {"limit": 10, "token": page["next"]}).json
+    assert [k for k, _ in rest["pairs"]] == ["key-2", "key-3", "key-4"]
+    assert rest["next"] is None
+    assert client.get("/db-dump").json == {"key-{0}".format(i): i for i in range(5)}
+
+    bad_token = base64.urlsafe_b64encode(b'["key", 5]').decode("ascii")
+    for params in ({"limit": -1}, {"limit": 0}, {"limit": "x"}, {"token": bad_token}, {"order": "value"}):
+        client.get("/db-scan", params, status=400)
+
+
+def test_expired_keys_are_filtered_and_purged(node, monkeypatch):
+    vacuums = []
+    monkeypatch.setattr(db, "incremental_vacuum", lambda conn: vacuums.append(conn))
+    for i in range(3):
+        node.set_local("session-{0}".format(i), i, ttl=0.05)
+    node.set_local("forever", 1)
+    time.sleep(0.1)
+
+    assert node.get_local_key("session-0") is None
+    assert not node.has_local_key("session-0")
+    assert node.get_local_pair_count() == 1
+    assert node.dump_db() == {"forever": 1}
+    assert node.expiry_stats() == {"expired": 3, "purged": 0}
+
+    assert node.purge_expired(batch_size=2) == 2
+    assert node.expiry_stats() == {"expired": 1, "purged": 2}
+    assert node.purge_expired() == 1
+    assert node.purge_expired() == 0
+    assert node.expiry_stats() == {"expired": 0, "purged": 3}
+    assert len(vacuums) == 2
+    assert node.get_local_key("forever") == 1
+
+
+def test_leave_keeps_remaining_ttl(tmp_path, hasher):
+    nodes = {}
+
+    def rpc_factory(addr):
+        return nodes[addr]
+
+    leaving, successor = [
+        Node("localhost", port, str(tmp_path / "{0}.db".format(port)), hasher, rpc_factory=rpc_factory)
+        for port in (8080, 8081)
+    ]
+    for n in (leaving, successor):
+        nodes[n.local_addr] = n
+        n.initialize()
+    leaving.successor = successor.local_addr
+    leaving.set_local("session", "s", ttl=60)
+    leaving.set_local("forever", "f")
+
+    leaving.leave()
+    assert successor.dump_db() == {"session": "s", "forever": "f"}
+    with successor.get_conn() as conn:
+        expiry = {row.key: row.expires_at for row in db.scan_kv_pairs(conn)}
+    assert expiry["forever"] is None
+    assert 59 < expiry["session"] - time.time() <= 60
+
+
+def test_background_worker_survives_purge_failure(monkeypatch):
+    shutdown_event = threading.Event()
+
+    class FailingPurgeNode(object):
+        def __init__(self):
+            self.cycles = 0
+            self.batch_sizes = []
+
+        def stabilize(self):
+            self.cycles += 1
+            if self.cycles == 2:
+                shutdown_event.set()
+
+        def fix_fingers(self):
+            pass
+
+        def check_predecessor(self):
+            pass
+
+        def refresh_rtt(self):
+            pass
+
+        def purge_expired(self, batch_size):
+            self.batch_sizes.append(batch_size)
+            raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(run_node.time, "sleep", lambda seconds: None)
+    node = FailingPurgeNode()
+    run_node.background_worker(node, shutdown_event, purge_batch_size=7)
+    assert node.cycles == 2
+    assert node.batch_sizes == [7, 7]
+
+
+def test_db_dump_is_paged(node, monkeypatch):
+    monkeypatch.setattr(db, "MAX_PAGE_SIZE", 4)
+    for i in range(10):
+        node.set_local("key-{0}".format(i), i)
+
+    assert [len(page) for page in node.iter_local_pages(page_size=4)] == [4, 4, 2]
+    assert node.dump_db() == {"key-{0}".format(i): i for i in range(4)}
+
+    app = Bottle()
+    attach_views(app, node)
+    environ = {"PATH_INFO": "/db-dump"}
+    setup_testing_defaults(environ)
+    chunks = list(app(environ, lambda status, headers, exc_info=None: None))
+    assert len(chunks) == 5
+    assert json.loads(b"".join(chunks)) == {"key-{0}".format(i): i for i in range(10)}
@@ -0,0 +1,128 @@
+import math
+import random
+
+import pytest
+
+from pychord.hashing import SHA1Hasher
+from pychord.simulator import RingSimulator, SimulatedNetwork, SimulatedRPCError, pairwise_latency, simulate
+
+
+@pytest.mark.parametrize("ring", [{"seed": 1, "lookup_rate": 20.0}], indirect=True)
+def test_converged_ring_lookups(ring):
+    assert ring.is_converged()
+
+    report = ring.run(10.0)
+    assert report["lookups"] > 0
+    assert report["lookup_failures"] == 0
+    assert report["mean_hops"] <= math.log2(256)
+    assert report["lookup_latency"]["mean"] == pytest.approx(report["mean_hops"] * 0.01)
+
+
+@pytest.mark.parametrize("ring", [{"nodes": 16, "seed": 2, "lookup_rate": 0.0, "converged": False}], indirect=True)
+def test_joined_ring_converges(ring):
+    assert not ring.is_converged()
+
+    report = ring.run(300.0)
+    assert report["converged"]
+    assert len(report["convergence_times"]) == 1
+    assert all(ring.lookup() for _ in range(50))
+
+
+@pytest.mark.parametrize("ring", [{"nodes": 4}], indirect=True)
+def test_storage_rpcs_are_rejected(ring):
+    node = ring.nodes[ring.true_successor(0)]
+    with pytest.raises(SimulatedRPCError):
+        node.remote_rpc(node.successor).set_local("key", "value")
+    with pytest.raises(SimulatedRPCError):
+        node.get("key")
+
+
+@pytest.mark.parametrize("ring", [
+    {"latency": pairwise_latency(0.001, 0.05, seed=3), "seed": 3, "lookup_rate": 20.0, "proximity_routing": False},
+    {"latency": pairwise_latency(0.001, 0.05, seed=3), "seed": 3, "lookup_rate": 20.0, "proximity_routing": True},
+], indirect=True)
+def test_proximity_routing_lookups(ring):
+    ring.warm_up(30.0)
+    if ring.proximity_routing:
+        assert all(node.rtt_estimates for node in ring.nodes.values())
+
+    report = ring.run(10.0)
+    assert report["lookup_failures"] == 0
+
+
+def test_proximity_routing_lowers_lookup_latency():
+    mean_latency = {}
+    for proximity_routing in (False, True):
+        network = SimulatedNetwork(pairwise_latency(0.001, 0.05, seed=4), rng=random.Random(4))
+        simulator = RingSimulator(
+            network, hasher=SHA1Hasher(size=32), seed=4, lookup_rate=50.0, proximity_routing=proximity_routing
+        )
+        simulator.bootstrap(256)
+        simulator.warm_up(60.0)
+        report = simulator.run(20.0)
+        assert report["lookup_failures"] == 0
+        mean_latency[proximity_routing] = report["lookup_latency"]["mean"]
+    assert mean_latency[True] < mean_latency[False]
+
+
+def test_proximity_routing_gain_at_default_ring_size():
+    reports = {
+        proximity_routing: simulate(300, 20.0, seed=6, lookup_rate=20.0, proximity_routing=proximity_routing)
+        for proximity_routing in (False, True)
+    }
+    assert reports[True]["lookup_failures"] == 0
+    assert reports[True]["lookup_latency"]["mean"] < 0.9 * reports[False]["lookup_latency"]["mean"]
+    # Pinging one finger per stabilize round stays well short of doubling maintenance traffic.
+    assert reports[True]["rpc_count"] < 1.5 * reports[False]["rpc_count"]
+
+
+@pytest.mark.parametrize("ring", [{"proximity_routing": True}], indirect=True)
+def test_fix_fingers_pings_only_new_fingers(ring):
+    node = ring.nodes[ring.true_successor(0)]
+    rpc_counts = []
+    for _ in range(2):
+        node._current_check_finger_index = 31
+        rpc_count = ring.network.rpc_count
+        node.fix_fingers()
+        rpc_counts.append(ring.network.rpc_count - rpc_count)
+    # The same finger resolved twice; only the first time had no estimate to reuse.
+    assert rpc_counts[0] == rpc_counts[1] + 1
+    assert node.fingers[31] in node.rtt_estimates
+
+    rpc_count = ring.network.rpc_count
+    node.refresh_rtt()
+    assert ring.network.rpc_count == rpc_count + 1
+    assert set(node.rtt_sampled_at) == set(node.rtt_estimates)
+
+
+@pytest.mark.parametrize("ring", [{"proximity_routing": True}], indirect=True)
+def test_closest_preceding_finger_prefers_low_rtt(ring):
+    node = ring.nodes[ring.true_successor(0)]
+    identifier = node.hashed_local_id + 2**31 + 2**30
+    node.proximity_routing = False
+    far_index, far = node.closest_preceding_finger(identifier)
+    near_index = max(i for i in range(1, far_index) if node.fingers[i] != far)
+    near = node.fingers[near_index]
+
+    node.rtt_estimates = {far: 0.5, near: 0.001, node.successor: 0.01}
+    assert node.closest_preceding_finger(identifier) == (far_index, far)
+    node.proximity_routing = True
+    assert node.closest_preceding_finger(identifier) == (near_index, near)
+
+    node.successor = None
+    assert node.closest_preceding_finger(identifier) == (far_index, far)
+
+
+@pytest.mark.parametrize("ring", [{"proximity_routing": True}], indirect=True)
+def test_rtt_estimates_forget_unreachable_peers(ring):
+    node = ring.nodes[ring.true_successor(0)]
+    node.check_predecessor()
+    node.stabilize()
+    state = node.dump_state()
+    assert set(state["rtt_estimates"]) == {node.predecessor, node.successor}
+    assert state["rtt_estimates"] is not node.rtt_estimates
+
+    ring.network.detach(node.predecessor)
+    node.check_predecessor()
+    assert node.predecessor is None
+    assert set(node.rtt_estimates) == {node.successor}
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from pychord.tracing import LookupTracer, LookupTraceError, hop_latencies, new_trace, next_hop
+
+
+def test_hop_latencies():
+    hops = [
+        {"addr": "a:1", "hop": 0, "finger_index": 5, "elapsed": 1.0},
+        {"addr": "b:1", "hop": 1, "finger_index": 3, "elapsed": 0.75},
+        {"addr": "c:1", "hop": 2, "finger_index": None, "elapsed": 0.25},
+    ]
+    assert [h["latency"] for h in hop_latencies(hops)] == [0.25, 0.5, 0.25]
+
+
+def test_tracer_sampling_and_slow_lookups():
+    tracer = LookupTracer(sample_rate=0.0, slow_threshold=0.5, max_records=2)
+    assert tracer.start() is None
+
+    trace = tracer.start(force=True)
+    assert trace["hop"] == 0
+    assert next_hop(trace) == {"trace_id": trace["trace_id"], "hop": 1}
+
+    tracer.record(trace, "fast", "a:1", [{"addr": "a:1", "hop": 0, "finger_index": None, "to": None, "elapsed": 0.1}])
+    slow = tracer.record(new_trace(), "slow", "b:1", [
+        {"addr": "a:1", "hop": 0, "finger_index": 2, "to": "b:1", "elapsed": 0.9},
+        {"addr": "b:1", "hop": 1, "finger_index": None, "to": None, "elapsed": 0.1},
+    ])
+    assert slow["hop_count"] == 1
+    assert [l["identifier"] for l in tracer.recent_lookups()] == ["slow", "fast"]
+    assert [l["identifier"] for l in tracer.slow_lookups()] == ["slow"]
+
+    tracer.record(new_trace(), "other", "c:1", [])
+    assert [l["identifier"] for l in tracer.recent_lookups()] == ["other", "slow"]
+
+
+RING = {"nodes": 64}
+
+
+@pytest.mark.parametrize("ring", [RING], indirect=True)
+def test_traced_lookup_matches_find_successor(ring):
+    origin = ring.nodes[ring.true_successor(0)]
+    rng = random.Random(6)
+    for _ in range(20):
+        identifier = rng.randrange(ring.hasher.max_value)
+        ring.network.begin_operation()
+        lookup = origin.trace_lookup(identifier)
+        assert lookup["hop_count"] == ring.network.op_hops == len(lookup["hops"]) - 1
+        assert lookup["successor"] == origin.find_successor(identifier) == ring.true_successor(identifier)
+        assert lookup["error"] is None
+
+        hops = lookup["hops"]
+        assert hops[0]["addr"] == origin.local_addr
+        assert [h["hop"] for h in hops] == list(range(len(hops)))
+        for hop, following in zip(hops, hops[1:]):
+            assert hop["to"] == following["addr"]
+            assert ring.nodes[hop["addr"]].fingers[hop["finger_index"]] == following["addr"]
+            # Routing hops double as RTT samples for the finger they used.
+            assert ring.nodes[hop["addr"]].rtt_estimates[hop["to"]] == pytest.approx(0.01)
+        assert hops[-1]["finger_index"] is None
+        assert hops[-1]["to"] is None
+        assert lookup["total"] == pytest.approx(0.01 * (len(hops) - 1))
+
+
+@pytest.mark.parametrize("ring", [RING], indirect=True)
+def test_failed_lookup_is_recorded(ring):
+    origin = ring.nodes[ring.true_successor(0)]
+    origin.tracer.sample_rate = 1.0
+    rng = random.Random(7)
+    hops = []
+    while len(hops) < 3:
+        identifier = rng.randrange(ring.hasher.max_value)
+        hops = origin.trace_lookup(identifier)["hops"]
+    ring.network.detach(hops[2]["addr"])
+
+    with pytest.raises(LookupTraceError):
+        origin.lookup(identifier)
+
+    failed = origin.tracer.slow_lookups()[0]
+    assert failed["error"] is not None
+    assert failed["failed_peer"] == hops[2]["addr"]
+    assert failed["successor"] is None
+    assert [h["addr"] for h in failed["hops"]] == [h["addr"] for h in hops[:2]]
+    assert failed["hop_count"] == 2
+    # The timeout is charged to the hop whose target is the dead peer.
+    assert failed["hops"][1]["to"] == failed["failed_peer"]
+    assert failed["hops"][1]["latency"] == pytest.approx(ring.network.timeout)